@@ -0,0 +1,83 @@
+# Ingredient text parsing and classification.
+# Kept free of FastAPI/Pydantic imports so it can optionally be compiled to a C
+# extension with mypyc (see README); main.py imports it the same way either way.
+import re
+from functools import lru_cache
+from typing import List, Optional, Set, Tuple
+
+import ahocorasick
+
+# (name, percentage, is_harmful, category)
+IngredientEntry = Tuple[str, Optional[float], bool, str]
+
+# Hidden sugars and harmful ingredients
+HIDDEN_SUGARS = frozenset({'maltodextrin', 'dextrose', 'fructose', 'sucrose', 'corn syrup', 'high fructose corn syrup',
+                           'fruit juice concentrate', 'honey', 'agave nectar', 'maple syrup', 'molasses'})
+
+HARMFUL_ADDITIVES = frozenset({'sodium nitrate', 'sodium nitrite', 'potassium bromate', 'propyl paraben', 'butylated hydroxyanisole',
+                               'butylated hydroxytoluene', 'potassium iodate', 'azodicarbonamide', 'brominated vegetable oil'})
+
+HEALTHY_INGREDIENTS = frozenset({'whole grain', 'olive oil', 'vegetable', 'fruit', 'nut', 'seed'})
+
+# Category codes, ordered by priority: a harmful match outranks a healthy one
+_CATEGORY_MODERATE, _CATEGORY_GOOD, _CATEGORY_HARMFUL = range(3)
+_CATEGORY_NAMES = ("moderate", "good", "harmful")
+
+# Build one Aho-Corasick automaton over all keyword lists at import time so each
+# ingredient line is classified in a single pass instead of one substring scan per keyword.
+# STORE_INTS keeps the category codes inside the C trie rather than as Python objects.
+INGREDIENT_AUTOMATON = ahocorasick.Automaton(ahocorasick.STORE_INTS)
+for _code, _terms in ((_CATEGORY_GOOD, HEALTHY_INGREDIENTS), (_CATEGORY_HARMFUL, HIDDEN_SUGARS | HARMFUL_ADDITIVES)):
+    for _term in _terms:
+        INGREDIENT_AUTOMATON.add_word(_term, _code)
+INGREDIENT_AUTOMATON.make_automaton()
+
+# Precompiled patterns used by parse_ingredient_entries. _INGREDIENT_RE walks the text once,
+# matching each entry up to the next comma or opening parenthesis and capturing a
+# trailing percentage; _PCT_RE handles the rare percentage inside an entry.
+_INGREDIENT_RE = re.compile(r'([^,(]*?)\s*(?:(\d+(?:\.\d+)?)%\s*)?(?=,|\(|\Z)')
+_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+
+# Classify an ingredient in one automaton pass; hidden sugars and harmful additives
+# take priority over generally healthy ingredients. Common names (sugar, salt, water)
+# recur across products, so results are memoized.
+@lru_cache(maxsize=4096)
+def classify_ingredient(name: str) -> Tuple[bool, str]:
+    code = _CATEGORY_MODERATE
+    for _, match_code in INGREDIENT_AUTOMATON.iter(name):
+        if match_code > code:
+            code = match_code
+            if code == _CATEGORY_HARMFUL:
+                break
+    return code == _CATEGORY_HARMFUL, _CATEGORY_NAMES[code]
+
+# Parse ingredients text into (name, percentage, is_harmful, category) entries
+def parse_ingredient_entries(ingredients_text: str) -> List[IngredientEntry]:
+    entries: List[IngredientEntry] = []
+    if not ingredients_text:
+        return entries
+    
+    # Lowercase the whole text once, then walk its entries, skipping repeated ones
+    seen: Set[str] = set()
+    for match in _INGREDIENT_RE.finditer(ingredients_text.lower()):
+        entry = match.group(0).strip()
+        if not entry or entry in seen:
+            continue
+        seen.add(entry)
+        
+        line: str = match.group(1).strip()
+        percentage_text: Optional[str] = match.group(2)
+        if '%' in line:
+            # Percentage in the middle of the entry (e.g. "milk 3.5% fat"): the first one wins,
+            # and the scan resumes after it to strip any others
+            percentage_match = _PCT_RE.search(line)
+            if percentage_match:
+                percentage_text = percentage_match.group(1)
+                line = (line[:percentage_match.start()] + _PCT_RE.sub('', line[percentage_match.end():])).strip()
+        percentage = float(percentage_text) if percentage_text else None
+        
+        is_harmful, category = classify_ingredient(line)
+        
+        entries.append((line, percentage, is_harmful, category))
+    
+    return entries
@@ -1,19 +1,27 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
+import asyncio
+from functools import lru_cache
+import httpx
+import orjson
 import re
-from typing import Dict, List, Optional
+import ahocorasick
+from typing import Dict, List, NamedTuple, Optional
 from pydantic import BaseModel
-from PIL import Image
-import io
 import base64
+import numpy as np
+import cv2
 import os
 from supabase import create_client, Client
 import pytesseract
 try:
     from .paddle_engine import paddle_engine, PaddleOCRResponse
+    from .ingredients import parse_ingredient_entries
 except ImportError:
     from paddle_engine import paddle_engine, PaddleOCRResponse
+    from ingredients import parse_ingredient_entries
 
 
 # Initialize Supabase client
@@ -43,8 +51,25 @@ def get_user_profile(user_id: str) -> Optional[Dict]:
         return None
 
 from rapidfuzz import process, fuzz
-
-app = FastAPI()
+from cachetools import TTLCache
+
+# Shared HTTP client so Open Food Facts calls reuse pooled connections. It is opened
+# and closed with the app lifespan, so a restarted app gets a fresh client
+http_client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, _batch_semaphore
+    # Redirects are followed as requests did
+    http_client = httpx.AsyncClient(http2=True, timeout=10.0, follow_redirects=True)
+    # Created here rather than at import so it belongs to the running event loop
+    # (on Python < 3.10 asyncio primitives bind to the loop current at creation)
+    _batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    await asyncio.get_running_loop().run_in_executor(paddle_engine.executor, paddle_engine.warmup)
+    yield
+    await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -68,22 +93,22 @@ def validate_ingredients(request: IngredientValidationRequest):
     # Pre-process OFF ingredients (target)
     off_processed = [i.lower() for i in request.off_ingredients]
     
+    # Pre-process OCR ingredients (queries), skipping fragments too short to match
+    queries = [ing for ing in (i.lower().strip() for i in request.ocr_ingredients) if len(ing) >= 3]
+    valid_ocr_count = len(queries)
     match_count = 0
-    valid_ocr_count = 0
     
-    for ing in request.ocr_ingredients:
-        ing = ing.lower().strip()
-        if len(ing) < 3: 
-            continue
-        valid_ocr_count += 1
-        
-        # Use WRatio for flexible matching (handles partials, ordering)
-        result = process.extractOne(ing, off_processed, scorer=fuzz.WRatio)
-        if result:
-            match_txt, score, idx = result
+    if queries:
+        # Score every query against every target in a single C call.
+        # Use WRatio for flexible matching (handles partials, ordering);
+        # scores below the high confidence threshold come back as 0
+        scores = process.cdist(queries, off_processed, scorer=fuzz.WRatio, score_cutoff=85, dtype=np.float64)
+        best = scores.argmax(axis=1)
+        for row, (ing, idx) in enumerate(zip(queries, best)):
+            score = scores[row, idx]
             if score >= 85: # High confidence match threshold
                 match_count += 1
-                matches.append({"ocr": ing, "off": match_txt, "score": score})
+                matches.append({"ocr": ing, "off": off_processed[idx], "score": float(score)})
     
     overlap_score = match_count / valid_ocr_count if valid_ocr_count > 0 else 0.0
     
@@ -115,6 +140,12 @@ class ProductAnalysis(BaseModel):
     processing_level: str
     personalized_recommendations: List[str]
 
+class NutFacts(NamedTuple):
+    sugars: float
+    salt: float
+    sat_fat: float
+    nova: int
+
 class CategorizedText(BaseModel):
     brand_name: Optional[str] = None
     slogans: List[str] = []
@@ -132,38 +163,56 @@ class OCRAnalysisResult(BaseModel):
 class OCRRequest(BaseModel):
     image_base64: str
 
-# Hidden sugars and harmful ingredients
-HIDDEN_SUGARS = ['maltodextrin', 'dextrose', 'fructose', 'sucrose', 'corn syrup', 'high fructose corn syrup', 
-                 'fruit juice concentrate', 'honey', 'agave nectar', 'maple syrup', 'molasses']
+class BatchAnalysisRequest(BaseModel):
+    barcodes: List[str]
+    user_id: Optional[str] = None
+
+# Open Food Facts product cache: fresh entries are served straight from memory, and once
+# an entry expires its ETag is sent back so an unchanged product only costs a 304
+_PRODUCT_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+# barcode -> (etag, product). Entries hold full OFF documents, so revalidation is
+# bounded too: only recently expired products are kept, for a day at most
+_PRODUCT_ETAGS = TTLCache(maxsize=1_000, ttl=86_400)
 
-HARMFUL_ADDITIVES = ['sodium nitrate', 'sodium nitrite', 'potassium bromate', 'propyl paraben', 'butylated hydroxyanisole',
-                     'butylated hydroxytoluene', 'potassium iodate', 'azodicarbonamide', 'brominated vegetable oil']
+def _cache_product(barcode: str, product: Dict, etag: Optional[str] = None) -> Dict:
+    _PRODUCT_CACHE[barcode] = product
+    if etag:
+        _PRODUCT_ETAGS[barcode] = (etag, product)
+    return product
 
 # Fetch product data from Open Food Facts with Ranking
-def get_product_data(barcode: str) -> Optional[Dict]:
+async def get_product_data(barcode: str) -> Optional[Dict]:
+    cached = _PRODUCT_CACHE.get(barcode)
+    if cached is not None:
+        return cached
+
     # Use search API to potentially find multiple entries for the same barcode (rare but possible)
     # or simply to standardize on the parsing logic
     url = f"https://world.openfoodfacts.org/cgi/search.pl?code={barcode}&search_simple=1&action=process&json=1"
+    validator = _PRODUCT_ETAGS.get(barcode)
+    headers = {"If-None-Match": validator[0]} if validator else None
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            products = data.get('products', [])
-            
-            if not products:
-                # Fallback to direct V0 API if search fails
-                fallback_url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
-                fb_res = requests.get(fallback_url, timeout=5)
-                if fb_res.status_code == 200 and fb_res.json().get('status') == 1:
-                    return fb_res.json()['product']
-                return None
-            
+        response = await http_client.get(url, headers=headers)
+        # 304 is not a success status, so handle revalidation before raise_for_status
+        if response.status_code == 304 and validator:
+            return _cache_product(barcode, validator[1])
+        response.raise_for_status()
+        products = orjson.loads(response.content).get('products', [])
+        if products:
             # Rank and select best candidate
             selected = select_best_candidate(products)
-            return selected
-            
+            return _cache_product(barcode, selected, response.headers.get('ETag'))
+
+        # Fallback to direct V0 API if search fails
+        fallback_url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+        fb_res = await http_client.get(fallback_url, timeout=5)
+        fb_res.raise_for_status()
+        fb_data = orjson.loads(fb_res.content)
+        if fb_data.get('status') == 1:
+            return _cache_product(barcode, fb_data['product'])
         return None
     except Exception as e:
+        # Besides HTTP errors, malformed OFF records can fail during ranking
         print(f"OFF API Error: {e}")
         return None
 
@@ -258,87 +307,60 @@ def select_best_candidate(products: List[Dict], ocr_ingredients: List[str] = Non
 
 # Parse ingredients text and extract percentages
 def parse_ingredients(ingredients_text: str) -> List[Ingredient]:
-    ingredients = []
-    if not ingredients_text:
-        return ingredients
-    
-    # Split ingredients by commas or other separators
-    lines = re.split(r',|\s*\(', ingredients_text)
-    
-    for line in lines:
-        line = line.strip().lower()
-        if not line:
-            continue
-            
-        # Extract percentage if available
-        percentage = None
-        percentage_match = re.search(r'(\d+(\.\d+)?)%', line)
-        if percentage_match:
-            percentage = float(percentage_match.group(1))
-            line = re.sub(r'(\d+(\.\d+)?)%', '', line).strip()
-        
-        # Check if ingredient is harmful
-        is_harmful = False
-        category = "moderate"
-        
-        # Check for hidden sugars
-        if any(sugar in line for sugar in HIDDEN_SUGARS):
-            is_harmful = True
-            category = "harmful"
-        # Check for harmful additives
-        elif any(additive in line for additive in HARMFUL_ADDITIVES):
-            is_harmful = True
-            category = "harmful"
-        # Check for generally healthy ingredients
-        elif any(healthy in line for healthy in ['whole grain', 'olive oil', 'vegetable', 'fruit', 'nut', 'seed']):
-            category = "good"
-        
-        ingredients.append(Ingredient(
-            name=line,
-            percentage=percentage,
-            is_harmful=is_harmful,
-            category=category
-        ))
-    
-    return ingredients
+    # Values are produced by the ingredients module, so skip per-object validation
+    return [
+        Ingredient.model_construct(name=name, percentage=percentage, is_harmful=is_harmful, category=category)
+        for name, percentage, is_harmful, category in parse_ingredient_entries(ingredients_text)
+    ]
+
+# Read the nutriment values used by alerts, scoring and recommendations once per product
+def extract_nut_facts(product_data: Dict) -> NutFacts:
+    nutriments = product_data.get('nutriments', {})
+    nova = product_data.get('nova_group', 1)
+    # Whole-number NOVA groups can arrive as floats (4.0); normalise them so alerts,
+    # scoring and the processing level lookup all see the same group
+    if isinstance(nova, float) and nova.is_integer():
+        nova = int(nova)
+    return NutFacts(
+        sugars=nutriments.get('sugars_100g', 0),
+        salt=nutriments.get('salt_100g', 0),
+        sat_fat=nutriments.get('saturated-fat_100g', 0),
+        nova=nova,
+    )
+
+# Nutriment threshold alerts: (NutFacts field, threshold per 100g, type, message template, severity)
+_ALERT_RULES = (
+    ('sugars', 10, "High Sugar", "This product is high in sugar ({}g per 100g). Consider limiting consumption.", "high"),
+    ('salt', 1.5, "High Salt", "This product is high in salt ({}g per 100g). Consider limiting consumption.", "high"),
+)
 
 # Generate health alerts based on product data
-def generate_alerts(product_data: Dict, ingredients: List[Ingredient]) -> List[HealthAlert]:
+def generate_alerts(nut: NutFacts, harmful_ingredients: List[Ingredient]) -> List[HealthAlert]:
+    # Alerts are built from fixed templates, so skip per-object validation
     alerts = []
     
-    # Check for high sugar
-    if 'nutriments' in product_data and 'sugars_100g' in product_data['nutriments']:
-        sugars = product_data['nutriments']['sugars_100g']
-        if sugars > 10:  # More than 10g per 100g is considered high
-            alerts.append(HealthAlert(
-                type="High Sugar",
-                message=f"This product is high in sugar ({sugars}g per 100g). Consider limiting consumption.",
-                severity="high"
-            ))
-    
-    # Check for high salt/sodium
-    if 'nutriments' in product_data and 'salt_100g' in product_data['nutriments']:
-        salt = product_data['nutriments']['salt_100g']
-        if salt > 1.5:  # More than 1.5g per 100g is considered high
-            alerts.append(HealthAlert(
-                type="High Salt",
-                message=f"This product is high in salt ({salt}g per 100g). Consider limiting consumption.",
-                severity="high"
+    # Check for high sugar and salt
+    for field, threshold, alert_type, template, severity in _ALERT_RULES:
+        value = getattr(nut, field)
+        if value > threshold:
+            alerts.append(HealthAlert.model_construct(
+                type=alert_type,
+                message=template.format(value),
+                severity=severity
             ))
     
     # Check for harmful ingredients
-    harmful_ingredients = [ing for ing in ingredients if ing.is_harmful]
     if harmful_ingredients:
         harmful_names = ", ".join([ing.name for ing in harmful_ingredients[:3]])
-        alerts.append(HealthAlert(
+        alerts.append(HealthAlert.model_construct(
             type="Harmful Ingredients",
             message=f"This product contains potentially harmful ingredients: {harmful_names}.",
             severity="medium"
         ))
     
     # Check if ultra-processed
-    if product_data.get('nova_group', 0) == 4:
-        alerts.append(HealthAlert(
+    if nut.nova == 4:
+        alerts.append(HealthAlert.model_construct(
             type="Ultra-Processed",
             message="This product is classified as ultra-processed food. Consider limiting consumption.",
             severity="medium"
@@ -346,45 +368,26 @@ def generate_alerts(product_data: Dict, ingredients: List[Ingredient]) -> List[H
     
     return alerts
 
+# Nutriment deductions: (NutFacts field, amount per 100g for the full deduction, max points)
+_SCORE_DEDUCTIONS = (
+    ('sugars', 20, 25),   # 20g sugar = max deduction
+    ('salt', 3, 20),      # 3g salt = max deduction
+    ('sat_fat', 10, 20),  # 10g fat = max deduction
+)
+
 # Calculate health score based on various factors
-def calculate_health_score(product_data: Dict, ingredients: List[Ingredient], alerts: List[HealthAlert]) -> int:
-    base_score = 100
-    
-    # Deduct points based on nutritional values
-    nutriments = product_data.get('nutriments', {})
-    
-    # Sugar deduction (up to 25 points)
-    sugars = nutriments.get('sugars_100g', 0)
-    sugar_deduction = min(25, (sugars / 20) * 25)  # 20g sugar = max deduction
-    base_score -= sugar_deduction
-    
-    # Salt deduction (up to 20 points)
-    salt = nutriments.get('salt_100g', 0)
-    salt_deduction = min(20, (salt / 3) * 20)  # 3g salt = max deduction
-    base_score -= salt_deduction
-    
-    # Saturated fat deduction (up to 20 points)
-    saturated_fat = nutriments.get('saturated-fat_100g', 0)
-    fat_deduction = min(20, (saturated_fat / 10) * 20)  # 10g fat = max deduction
-    base_score -= fat_deduction
-    
-    # Deduct for harmful ingredients (up to 15 points)
-    harmful_count = sum(1 for ing in ingredients if ing.is_harmful)
-    harmful_deduction = min(15, harmful_count * 3)
-    base_score -= harmful_deduction
-    
-    # Deduct for processing level (up to 20 points)
-    nova_group = product_data.get('nova_group', 1)
-    processing_deduction = (nova_group - 1) * 7  # 7 points per processing level
-    base_score -= min(20, processing_deduction)
-    
+def calculate_health_score(nut: NutFacts, harmful_count: int) -> int:
+    score = 100
+    for field, full_amount, max_points in _SCORE_DEDUCTIONS:
+        score -= min(max_points, (getattr(nut, field) / full_amount) * max_points)
+    score -= min(15, harmful_count * 3)       # 3 points per harmful ingredient
+    score -= min(20, (nut.nova - 1) * 7)      # 7 points per processing level
     # Ensure score is between 0 and 100
-    return max(0, min(100, round(base_score)))
+    return max(0, min(100, round(score)))
 
 # personalized health recommendation 
-def get_personalized_recommendations(product_data: Dict, ingredients: List[Ingredient], conditions: List[str], allergies: List[str]) -> List[str]:
+def get_personalized_recommendations(nut: NutFacts, ingredients: List[Ingredient], conditions: List[str], allergies: List[str]) -> List[str]:
     recommendations = []
-    nutriments = product_data.get('nutriments', {})
     
     # Check for medical conditions
     conditions_lower = [cond.lower() for cond in conditions]
@@ -392,7 +395,7 @@ def get_personalized_recommendations(product_data: Dict, ingredients: List[Ingre
     
     # Diabetes/Sugar conditions
     if any(cond in conditions_lower for cond in ['diabetes', 'sugar', 'diabetic']):
-        sugars = nutriments.get('sugars_100g', 0)
+        sugars = nut.sugars
         if sugars > 10:
             recommendations.append(f"⚠️ High sugar content ({sugars}g) - not recommended for diabetes")
         elif sugars > 5:
@@ -402,7 +405,7 @@ def get_personalized_recommendations(product_data: Dict, ingredients: List[Ingre
     
     # Hypertension/Blood pressure conditions
     if any(cond in conditions_lower for cond in ['high bp', 'hypertension', 'blood pressure']):
-        salt = nutriments.get('salt_100g', 0)
+        salt = nut.salt
         if salt > 1.5:
             recommendations.append(f"⚠️ High salt content ({salt}g) - not recommended for hypertension")
         elif salt > 0.6:
@@ -412,7 +415,7 @@ def get_personalized_recommendations(product_data: Dict, ingredients: List[Ingre
     
     # Heart conditions
     if any(cond in conditions_lower for cond in ['heart disease', 'cholesterol', 'cardiac']):
-        saturated_fat = nutriments.get('saturated-fat_100g', 0)
+        saturated_fat = nut.sat_fat
         if saturated_fat > 5:
             recommendations.append(f"⚠️ High saturated fat ({saturated_fat}g) - not recommended for heart conditions")
         elif saturated_fat > 2:
@@ -434,45 +437,47 @@ def get_personalized_recommendations(product_data: Dict, ingredients: List[Ingre
     
     return recommendations
 
-# Main endpoint to analyze product
-# Update the analyze-product endpoint to accept user_id
-@app.post("/analyze-product", response_model=ProductAnalysis)
-async def analyze_product(barcode: str, user_id: Optional[str] = None):
-    # Fetch product data from Open Food Facts
-    product_data = get_product_data(barcode)
-    if not product_data:
-        raise HTTPException(status_code=404, detail="Product not found")
+# Processing level labels indexed by NOVA group (1-4)
+_PROCESSING_LEVELS = (
+    "Unknown",
+    "Unprocessed or minimally processed",
+    "Processed culinary ingredients",
+    "Processed foods",
+    "Ultra-processed foods",
+)
+
+# Build the full analysis for one Open Food Facts product
+def build_product_analysis(product_data: Dict, user_profile: Optional[Dict] = None) -> ProductAnalysis:
+    nut = extract_nut_facts(product_data)
     
     # Parse ingredients
     ingredients_text = product_data.get('ingredients_text', '')
     ingredients = parse_ingredients(ingredients_text)
     
+    # Harmful ingredients are collected once and shared by alerts and scoring
+    harmful_ingredients = [ing for ing in ingredients if ing.is_harmful]
+    
     # Generate alerts
-    alerts = generate_alerts(product_data, ingredients)
+    alerts = generate_alerts(nut, harmful_ingredients)
     
     # Calculate health score
-    health_score = calculate_health_score(product_data, ingredients, alerts)
+    health_score = calculate_health_score(nut, len(harmful_ingredients))
     
-    # Get user profile and generate personalized recommendations
+    # Generate personalized recommendations from the user profile
     personalized_recommendations = []
-    if user_id:
-        user_profile = get_user_profile(user_id)
-        if user_profile:
-            conditions = user_profile.get('medical_conditions', [])
-            allergies = user_profile.get('allergies', [])
-            personalized_recommendations = get_personalized_recommendations(
-                product_data, ingredients, conditions, allergies
-            )
+    if user_profile:
+        conditions = user_profile.get('medical_conditions', [])
+        allergies = user_profile.get('allergies', [])
+        personalized_recommendations = get_personalized_recommendations(
+            nut, ingredients, conditions, allergies
+        )
     
     # Determine processing level
-    nova_group = product_data.get('nova_group', 1)
-    processing_levels = {
-        1: "Unprocessed or minimally processed",
-        2: "Processed culinary ingredients",
-        3: "Processed foods",
-        4: "Ultra-processed foods"
-    }
-    processing_level = processing_levels.get(nova_group, "Unknown")
+    nova_group = nut.nova
+    if isinstance(nova_group, int) and 0 <= nova_group < len(_PROCESSING_LEVELS):
+        processing_level = _PROCESSING_LEVELS[nova_group]
+    else:
+        processing_level = "Unknown"
     
     return ProductAnalysis(
         product_name=product_data.get('product_name', 'Unknown Product'),
@@ -485,113 +490,236 @@ async def analyze_product(barcode: str, user_id: Optional[str] = None):
         personalized_recommendations=personalized_recommendations
     )
 
+# Main endpoint to analyze product
+# Update the analyze-product endpoint to accept user_id
+@app.post("/analyze-product", response_model=ProductAnalysis)
+async def analyze_product(barcode: str, user_id: Optional[str] = None):
+    # Fetch product data from Open Food Facts
+    product_data = await get_product_data(barcode)
+    if not product_data:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    user_profile = get_user_profile(user_id) if user_id else None
+    analysis = build_product_analysis(product_data, user_profile)
+    # The model is already validated, so serialize it directly instead of letting
+    # FastAPI revalidate it against response_model and run jsonable_encoder
+    return ORJSONResponse(analysis.model_dump())
+
+# Most barcodes accepted in one /analyze-batch request
+MAX_BATCH_BARCODES = 50
+# Maximum number of Open Food Facts requests in flight across all batch requests
+BATCH_CONCURRENCY = 10
+_batch_semaphore: Optional[asyncio.Semaphore] = None  # created in lifespan
+
+# Batch endpoint: products are fetched concurrently, so a batch takes roughly as long
+# as its slowest lookup. Results follow the request order; unknown barcodes are null.
+@app.post("/analyze-batch", response_model=List[Optional[ProductAnalysis]])
+async def analyze_batch(request: BatchAnalysisRequest):
+    if len(request.barcodes) > MAX_BATCH_BARCODES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_BARCODES} barcodes per batch")
+
+    async def fetch(barcode: str) -> Optional[Dict]:
+        async with _batch_semaphore:
+            return await get_product_data(barcode)
+
+    barcodes = list(dict.fromkeys(request.barcodes))
+    products = dict(zip(barcodes, await asyncio.gather(*(fetch(b) for b in barcodes))))
+    
+    user_profile = get_user_profile(request.user_id) if request.user_id else None
+    analyses = {}
+    for barcode, product_data in products.items():
+        if not product_data:
+            continue
+        # A malformed OFF record only nulls its own slot instead of failing the batch
+        try:
+            analyses[barcode] = build_product_analysis(product_data, user_profile).model_dump()
+        except Exception as e:
+            print(f"Batch analysis error for {barcode}: {e}")
+    return ORJSONResponse([analyses.get(barcode) for barcode in request.barcodes])
+
+# Ranked search results by normalized query; searches are repeated far less than
+# barcodes, so the cache is smaller and shorter-lived than _PRODUCT_CACHE
+_SEARCH_CACHE = TTLCache(maxsize=1_000, ttl=600)
+
 # Endpoint for product search by name
 @app.get("/search-product/{product_name}")
 async def search_product(product_name: str):
+    cache_key = product_name.strip().lower()
+    cached = _SEARCH_CACHE.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(cached)
+
     url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={product_name}&search_simple=1&action=process&json=1"
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            products = data.get('products', [])
-            if not products:
-                return []
-                
-            # Use calculate_quality_score to sort the products
-            ranked = []
-            for p in products:
-                qs = calculate_quality_score(p)
-                ranked.append((qs['score'], p))
+        response = await http_client.get(url)
+        response.raise_for_status()
+        products = orjson.loads(response.content).get('products', [])
+        if not products:
+            return []
             
-            # Sort descending
-            ranked.sort(key=lambda x: x[0], reverse=True)
-            
-            # Return top 10 products
-            return [r[1] for r in ranked[:10]]
-            
-        return []
+        # Use calculate_quality_score to sort the products
+        ranked = []
+        for p in products:
+            qs = calculate_quality_score(p)
+            ranked.append((qs['score'], p))
+        
+        # Sort descending
+        ranked.sort(key=lambda x: x[0], reverse=True)
+        
+        # Return top 10 products, handing the raw OFF dicts straight to orjson
+        top_products = [r[1] for r in ranked[:10]]
     except Exception:
+        # Network errors and malformed OFF payloads alike yield no results
         return []
+    _SEARCH_CACHE[cache_key] = top_products
+    return ORJSONResponse(top_products)
+
+# Precompiled patterns used by the OCR text helpers
+_NUTRITION_SPLIT_RE = re.compile(r'[:\-]')
+_INGREDIENTS_SECTION_RE = re.compile(r'ingredients?[\s:]+([^.]+)')
+_INGREDIENT_ITEM_RE = re.compile(r'[^,;()]+')
+_PERCENTAGE_RE = re.compile(r'\d+(?:\.\d+)?%')
+
+# Text block categories, ordered by priority: a nutrition keyword wins over a
+# marketing keyword, which wins over a slogan indicator
+_TEXT_OTHER, _TEXT_SLOGAN, _TEXT_MARKETING, _TEXT_NUTRITION = range(4)
+
+NUTRITION_KEYWORDS = ['calories', 'protein', 'fat', 'carbohydrate', 'sugar', 'sodium', 
+                      'fiber', 'vitamin', 'calcium', 'iron', 'serving', 'nutrition facts',
+                      'energy', 'kcal', 'kj', 'saturated', 'trans', 'cholesterol']
+MARKETING_KEYWORDS = ['new', 'improved', 'natural', 'organic', 'premium', 'fresh', 
+                      'healthy', 'delicious', 'tasty', 'best', 'quality', 'authentic',
+                      'traditional', 'homemade', 'artisan', 'gourmet', 'special']
+SLOGAN_INDICATORS = ['!', 'taste', 'experience', 'enjoy', 'love', 'perfect', 'ultimate']
+
+# One automaton over all keyword groups so each text block is categorized in a single pass
+TEXT_CATEGORY_AUTOMATON = ahocorasick.Automaton(ahocorasick.STORE_INTS)
+for _code, _keywords in ((_TEXT_SLOGAN, SLOGAN_INDICATORS), (_TEXT_MARKETING, MARKETING_KEYWORDS), (_TEXT_NUTRITION, NUTRITION_KEYWORDS)):
+    for _keyword in _keywords:
+        TEXT_CATEGORY_AUTOMATON.add_word(_keyword, _code)
+TEXT_CATEGORY_AUTOMATON.make_automaton()
 
 # --- OCR helper functions using pytesseract ---
 def categorize_text(text_blocks: List[tuple]) -> CategorizedText:
-    categorized = CategorizedText()
-    nutrition_keywords = ['calories', 'protein', 'fat', 'carbohydrate', 'sugar', 'sodium', 
-                         'fiber', 'vitamin', 'calcium', 'iron', 'serving', 'nutrition facts',
-                         'energy', 'kcal', 'kj', 'saturated', 'trans', 'cholesterol']
-    marketing_keywords = ['new', 'improved', 'natural', 'organic', 'premium', 'fresh', 
-                         'healthy', 'delicious', 'tasty', 'best', 'quality', 'authentic',
-                         'traditional', 'homemade', 'artisan', 'gourmet', 'special']
-    slogan_indicators = ['!', 'taste', 'experience', 'enjoy', 'love', 'perfect', 'ultimate']
-
-    all_text = []
-    brand_candidates = []
-
-    for text, conf in text_blocks:
+    # Build a fresh model from the memoized categorization, so callers can't
+    # mutate what the cache holds
+    brand_name, slogans, marketing_text, nutrition_facts, miscellaneous = \
+        _categorize_text_cached(tuple(text for text, _ in text_blocks))
+    return CategorizedText.model_construct(
+        brand_name=brand_name,
+        slogans=list(slogans),
+        marketing_text=list(marketing_text),
+        nutrition_facts=dict(nutrition_facts),
+        miscellaneous=list(miscellaneous),
+    )
+
+# Retried uploads and repeat photos of the same label yield the same text, so
+# categorization is memoized on the block texts (confidence does not affect it).
+# Results are cached as tuples so they stay immutable.
+@lru_cache(maxsize=1024)
+def _categorize_text_cached(texts: tuple) -> tuple:
+    slogans = []
+    marketing_text = []
+    nutrition_facts = {}
+    miscellaneous = []
+    brand_name = None
+
+    for text in texts:
         text_lower = text.lower().strip()
         if not text_lower or len(text_lower) < 2:
             continue
-        all_text.append(text)
-        if text.isupper() and len(text) > 2 and len(text) < 30:
-            brand_candidates.append(text)
-        if any(keyword in text_lower for keyword in nutrition_keywords):
-            parts = re.split(r'[:\-]', text)
+        if brand_name is None and text.isupper() and 2 < len(text) < 30:
+            brand_name = text
+        
+        category = _TEXT_OTHER
+        for _, match_code in TEXT_CATEGORY_AUTOMATON.iter(text_lower):
+            if match_code > category:
+                category = match_code
+                if category == _TEXT_NUTRITION:
+                    break
+        
+        if category == _TEXT_NUTRITION:
+            parts = _NUTRITION_SPLIT_RE.split(text)
             if len(parts) == 2:
-                categorized.nutrition_facts[parts[0].strip()] = parts[1].strip()
+                nutrition_facts[parts[0].strip()] = parts[1].strip()
             else:
-                categorized.miscellaneous.append(text)
-        elif any(keyword in text_lower for keyword in marketing_keywords):
-            categorized.marketing_text.append(text)
-        elif any(indicator in text_lower for indicator in slogan_indicators) or '!' in text:
-            categorized.slogans.append(text)
+                miscellaneous.append(text)
+        elif category == _TEXT_MARKETING:
+            marketing_text.append(text)
+        elif category == _TEXT_SLOGAN:
+            slogans.append(text)
         else:
-            categorized.miscellaneous.append(text)
+            miscellaneous.append(text)
 
-    if brand_candidates:
-        categorized.brand_name = brand_candidates[0]
-        categorized.miscellaneous = [t for t in categorized.miscellaneous if t != categorized.brand_name]
+    if brand_name is not None:
+        miscellaneous = [t for t in miscellaneous if t != brand_name]
 
-    return categorized
+    return (brand_name, tuple(slogans), tuple(marketing_text),
+            tuple(nutrition_facts.items()), tuple(miscellaneous))
 
 def extract_ingredients(text_blocks: List[str]) -> List[str]:
-    ingredients = []
-    full_text = ' '.join(text_blocks)
-    ingredients_pattern = r'ingredients?[\s:]+([^.]+)'
-    match = re.search(ingredients_pattern, full_text.lower())
-    if match:
-        ingredients_text = match.group(1)
-        raw_ingredients = re.split(r',|;|\(|\)', ingredients_text)
-        for ing in raw_ingredients:
-            ing = re.sub(r'\d+(\.\d+)?%', '', ing).strip()
-            if ing and len(ing) > 1:
-                ingredients.append(ing.capitalize())
-    return ingredients
+    return list(_extract_ingredients_cached(' '.join(text_blocks)))
+
+# Memoized on the joined OCR text; returns a tuple so cached results stay immutable
+@lru_cache(maxsize=1024)
+def _extract_ingredients_cached(full_text: str) -> tuple:
+    match = _INGREDIENTS_SECTION_RE.search(full_text.lower())
+    if not match:
+        return ()
+    # Percentages never contain separators, so strip them from the whole section
+    # at once, then walk the items between separators in a single pass
+    ingredients_text = _PERCENTAGE_RE.sub('', match.group(1))
+    items = (m.group().strip() for m in _INGREDIENT_ITEM_RE.finditer(ingredients_text))
+    return tuple(ing.capitalize() for ing in items if len(ing) > 1)
+
+# Build the structured OCR result from (text, confidence) blocks
+def build_ocr_result(text_blocks: List[tuple]) -> OCRAnalysisResult:
+    all_text = [text for text, _ in text_blocks]
+    confidences = np.fromiter((conf for _, conf in text_blocks), dtype=np.float64, count=len(text_blocks))
+    avg_confidence = float(confidences.mean()) * 100 if text_blocks else 0
+
+    return OCRAnalysisResult(
+        success=True,
+        ingredients=extract_ingredients(all_text),
+        categorized_text=categorize_text(text_blocks),
+        raw_text='\n'.join(all_text),
+        confidence=round(avg_confidence, 2)
+    )
+
+# Decode an image and OCR it with pytesseract. Blocking: the endpoints run it in
+# the default threadpool (each call spawns its own tesseract process, so calls
+# can safely overlap)
+def analyze_image_bytes(contents: bytes) -> OCRAnalysisResult:
+    # Decode straight from the upload buffer; Tesseract works on grayscale,
+    # so skip the colour planes entirely
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Could not decode image.")
+
+    ocr_result = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    text_blocks = [(text, float(conf) / 100 if conf != '-1' else 0.5)
+                   for text, conf in zip(ocr_result['text'], ocr_result['conf']) if text.strip() != '']
+    return build_ocr_result(text_blocks)
+
+# Largest image accepted by the OCR endpoints
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+
+def check_upload_size(size: int):
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
 
 # --- OCR endpoints using pytesseract ---
 @app.post("/analyze-image", response_model=OCRAnalysisResult)
 async def analyze_image(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-
-        # OCR using pytesseract
-        ocr_result = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-        text_blocks = [(ocr_result['text'][i], float(ocr_result['conf'][i])/100 if ocr_result['conf'][i] != '-1' else 0.5) 
-                       for i in range(len(ocr_result['text'])) if ocr_result['text'][i].strip() != '']
-        all_text = [t[0] for t in text_blocks]
-        avg_confidence = (sum([t[1] for t in text_blocks]) / len(text_blocks)) * 100 if text_blocks else 0
-
-        ingredients = extract_ingredients(all_text)
-        categorized = categorize_text(text_blocks)
-        raw_text = '\n'.join(all_text)
-
-        return OCRAnalysisResult(
-            success=True,
-            ingredients=ingredients,
-            categorized_text=categorized,
-            raw_text=raw_text,
-            confidence=round(avg_confidence, 2)
-        )
+        # Starlette has already spooled the multipart body to a temp file; reading at most
+        # one byte past the limit keeps an oversized upload from being copied into memory
+        contents = await file.read(MAX_UPLOAD_BYTES + 1)
+        check_upload_size(len(contents))
+        result = await asyncio.get_running_loop().run_in_executor(None, analyze_image_bytes, contents)
+        return ORJSONResponse(result.model_dump())
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
@@ -604,21 +732,54 @@ async def analyze_image_base64(image_data: dict):
             raise HTTPException(status_code=400, detail="No image data provided")
         if ',' in image_base64:
             image_base64 = image_base64.split(',')[1]
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
-        return await analyze_image(UploadFile(file=io.BytesIO(image_bytes), filename="image.png"))
+        # Every 4 base64 characters decode to 3 bytes
+        check_upload_size(len(image_base64) * 3 // 4)
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(None, base64.b64decode, image_base64)
+        result = await loop.run_in_executor(None, analyze_image_bytes, image_bytes)
+        return ORJSONResponse(result.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
+
+# Most images accepted in one /analyze-image-batch request
+MAX_BATCH_IMAGES = 10
+
+# Multi-image endpoint (e.g. front and back of a label), OCR'd with PaddleOCR as one job
+@app.post("/analyze-image-batch", response_model=List[OCRAnalysisResult])
+async def analyze_image_batch(files: List[UploadFile] = File(...)):
+    try:
+        if len(files) > MAX_BATCH_IMAGES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IMAGES} images per batch")
+        images = []
+        for file in files:
+            contents = await file.read(MAX_UPLOAD_BYTES + 1)
+            check_upload_size(len(contents))
+            images.append(contents)
+        responses = await paddle_engine.process_images_async(images)
+        results = [build_ocr_result([(line.text, line.confidence) for line in response.lines])
+                   for response in responses]
+        return ORJSONResponse([result.model_dump() for result in results])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
 # PaddleOCR specific endpoint
 @app.post("/ocr", response_model=PaddleOCRResponse)
-def run_paddle_ocr(request: OCRRequest):
+async def run_paddle_ocr(request: OCRRequest):
     """
     Run PaddleOCR on the provided base64 image.
-    This runs synchronously in a threadpool to avoid blocking the event loop.
+    Decoding runs in a threadpool and inference is queued on the engine's
+    dedicated OCR thread, so the event loop is never blocked.
     """
     try:
-        return paddle_engine.process_base64(request.image_base64)
+        check_upload_size(len(request.image_base64) * 3 // 4)
+        result = await paddle_engine.process_base64_async(request.image_base64)
+        return ORJSONResponse(result.model_dump())
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"PaddleOCR Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
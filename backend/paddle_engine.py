@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 from paddleocr import PaddleOCR
@@ -21,9 +24,31 @@ class PaddleOCRLine(BaseModel):
 class PaddleOCRResponse(BaseModel):
     lines: List[PaddleOCRLine]
 
+# Longest image side handed to PaddleOCR. The detector already works at
+# det_limit_side_len, but recognition crops text from the image it is given, so
+# the cap stays well above that to keep small ingredient text legible; it only
+# bounds memory for very large photos. Boxes are scaled back to the original image.
+MAX_SIDE_LEN = 2048
+
+# (x, y) factors from original image pixels to the pixels PaddleOCR saw
+Scale = Tuple[float, float]
+
+def limit_side_len(img: np.ndarray, max_side: int = MAX_SIDE_LEN) -> Tuple[np.ndarray, Scale]:
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return img, (1.0, 1.0)
+    # Clamp so very thin images (e.g. 4000x3) keep at least one pixel per side; the
+    # per-axis factors then come from the actual resized shape
+    new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    return resized, (new_w / w, new_h / h)
+
 class PaddleEngine:
     def __init__(self):
         self.ocr = None
+        # Paddle predictors are not re-entrant, so all inference is queued on one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paddle-ocr")
         self._initialize_model()
 
     def _initialize_model(self):
@@ -31,25 +56,42 @@ class PaddleEngine:
             logger.info("Loading PaddleOCR model...")
             # use_angle_cls=True for angle classification
             # lang='en' for English
-            self.ocr = PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
+            # rec_batch_num=1: Paddle pre-allocates inference memory per recognition batch
+            # and CPU recognition gains nothing from batching, so keep batches minimal
+            options = dict(use_angle_cls=True, lang='en', show_log=False,
+                           rec_batch_num=1, det_limit_side_len=960, use_mp=False)
+
+            # Optionally run the same PP-OCR models through ONNX Runtime
+            # (export with paddle2onnx; see README)
+            onnx_dir = os.getenv("PADDLE_OCR_ONNX_DIR")
+            if onnx_dir:
+                options.update(
+                    use_onnx=True,
+                    det_model_dir=os.path.join(onnx_dir, "det.onnx"),
+                    rec_model_dir=os.path.join(onnx_dir, "rec.onnx"),
+                    cls_model_dir=os.path.join(onnx_dir, "cls.onnx"),
+                )
+                logger.info(f"Using ONNX Runtime models from {onnx_dir}")
+
+            self.ocr = PaddleOCR(**options)
             logger.info("PaddleOCR model loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load PaddleOCR model: {e}")
             self.ocr = None
 
-    def process_base64(self, base64_string: str) -> PaddleOCRResponse:
-        if not self.ocr:
-            # Try to re-init if it failed previously or wasn't loaded
-            self._initialize_model()
-            if not self.ocr:
-                raise RuntimeError("PaddleOCR model is not active.")
-
+    def decode_base64(self, base64_string: str) -> np.ndarray:
         # Decode Base64
         if "," in base64_string:
             base64_string = base64_string.split(",")[1]
         
         try:
             img_bytes = base64.b64decode(base64_string)
+        except Exception as e:
+            raise ValueError(f"Invalid image data: {e}")
+        return self.decode_bytes(img_bytes)
+
+    def decode_bytes(self, img_bytes: bytes) -> np.ndarray:
+        try:
             np_arr = np.frombuffer(img_bytes, np.uint8)
             img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
         except Exception as e:
@@ -57,31 +99,86 @@ class PaddleEngine:
 
         if img is None:
             raise ValueError("Could not decode image.")
+        return img
+
+    def run_ocr(self, img: np.ndarray) -> list:
+        if not self.ocr:
+            # Try to re-init if it failed previously or wasn't loaded
+            self._initialize_model()
+            if not self.ocr:
+                raise RuntimeError("PaddleOCR model is not active.")
 
         # Run OCR
         # result is a list of [ [box, [text, score]] ]
         # PaddleOCR returns a list of results (one per image passed). We passed one image.
-        result = self.ocr.ocr(img, cls=True)
+        return self.ocr.ocr(img, cls=True)
+
+    def run_ocr_batch(self, imgs: List[np.ndarray]) -> List[list]:
+        # PaddleOCR 2.x takes one image per call, so a batch is one executor job that
+        # runs the images back to back instead of re-queuing behind other requests
+        return [self.run_ocr(img) for img in imgs]
+
+    def warmup(self):
+        # Run a rendered line of text through the pipeline so the first request doesn't
+        # pay for predictor and memory arena setup. A blank image yields no detection
+        # boxes, which would leave the angle classifier and recognizer cold.
+        img = np.full((160, 960, 3), 255, np.uint8)
+        cv2.putText(img, "INGREDIENTS: SUGAR, SALT", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+        try:
+            self.run_ocr(img)
+            logger.info("PaddleOCR warmed up.")
+        except Exception as e:
+            logger.error(f"PaddleOCR warmup failed: {e}")
+
+    def prepare_base64(self, base64_string: str) -> Tuple[np.ndarray, Scale]:
+        return limit_side_len(self.decode_base64(base64_string))
 
+    def prepare_images(self, images: List[bytes]) -> List[Tuple[np.ndarray, Scale]]:
+        return [limit_side_len(self.decode_bytes(img_bytes)) for img_bytes in images]
+
+    def to_response(self, result: list, scale: Scale = (1.0, 1.0)) -> PaddleOCRResponse:
         if not result or result[0] is None:
             return PaddleOCRResponse(lines=[])
 
+        # Round all confidences in one vectorized call
+        scores = np.round(np.fromiter((line[1][1] for line in result[0]), dtype=np.float64, count=len(result[0])), 4).tolist()
+
         lines = []
-        for line in result[0]:
+        for line, score in zip(result[0], scores):
             # line structure: [ [[x1,y1],[x2,y2],[x3,y3],[x4,y4]], (text, confidence) ]
             box = line[0]
-            text, score = line[1]
+            text = line[1][0]
             
-            # Ensure box coordinates are floats/ints
-            clean_box = [[float(coord[0]), float(coord[1])] for coord in box]
+            # Convert and rescale the whole box to original image pixels in one numpy op
+            clean_box = (np.asarray(box, dtype=np.float64) / scale).tolist()
 
             lines.append(PaddleOCRLine(
                 text=text,
-                confidence=round(score, 4),
+                confidence=score,
                 box=clean_box
             ))
 
         return PaddleOCRResponse(lines=lines)
 
+    def process_base64(self, base64_string: str) -> PaddleOCRResponse:
+        img, scale = self.prepare_base64(base64_string)
+        return self.to_response(self.run_ocr(img), scale)
+
+    async def process_base64_async(self, base64_string: str) -> PaddleOCRResponse:
+        # Pipeline: decoding and resizing run in the default threadpool so it overlaps with inference
+        # for other requests, OCR waits its turn on the dedicated Paddle thread, and the
+        # light post-processing runs back on the event loop
+        loop = asyncio.get_running_loop()
+        img, scale = await loop.run_in_executor(None, self.prepare_base64, base64_string)
+        result = await loop.run_in_executor(self.executor, self.run_ocr, img)
+        return self.to_response(result, scale)
+
+    async def process_images_async(self, images: List[bytes]) -> List[PaddleOCRResponse]:
+        # Same pipeline as process_base64_async, with the whole batch as one OCR job
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(None, self.prepare_images, images)
+        results = await loop.run_in_executor(self.executor, self.run_ocr_batch, [img for img, _ in prepared])
+        return [self.to_response(result, scale) for result, (_, scale) in zip(results, prepared)]
+
 # Create a singleton instance
 paddle_engine = PaddleEngine()